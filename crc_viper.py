@@ -0,0 +1,18 @@
+# Native-code STM32 CRC32 loop for upload_firmware.py. Kept in its own
+# module because @micropython.viper is a compile-time error on builds
+# without the native emitter; upload_firmware.py falls back if this
+# module fails to import.
+import micropython
+
+# CRC the first n bytes of data (a multiple of 4) with the MSB-first table,
+# feeding each little-endian word's bytes in order 3, 2, 1, 0
+@micropython.viper
+def stm32_crc32_words(crc: uint, data: ptr8, n: int, table: ptr32) -> uint:
+    i = 0
+    while i < n:
+        crc = (crc << 8) ^ uint(table[int((crc >> 24) & 0xFF) ^ data[i + 3]])
+        crc = (crc << 8) ^ uint(table[int((crc >> 24) & 0xFF) ^ data[i + 2]])
+        crc = (crc << 8) ^ uint(table[int((crc >> 24) & 0xFF) ^ data[i + 1]])
+        crc = (crc << 8) ^ uint(table[int((crc >> 24) & 0xFF) ^ data[i]])
+        i += 4
+    return crc
@@ -1,6 +1,8 @@
 import os
 import json
 import time
+import errno
+import select
 import network
 import socket
 import binascii
@@ -11,6 +13,7 @@ from machine import Pin
 WIFI_SSID = "GEARBOX EUROPLACER"
 WIFI_PASS = "Euro@2023"
 SERVER_PORT = 80
+CONN_TIMEOUT_MS = 10000  # Drop clients that stall longer than this
 API_USERNAME = "admin"
 API_PASSWORD = "admin"
 LED = Pin("LED", Pin.OUT)  # Onboard LED for status indication
@@ -18,6 +21,7 @@ LED = Pin("LED", Pin.OUT)  # Onboard LED for status indication
 # Directory structure
 FIRMWARE_DIR = "/firmware"
 METADATA_FILE = "/firmware/metadata.json"
+METADATA_LOG = "/firmware/metadata.json.log"
 
 # Ensure firmware directory exists
 def setup_storage():
@@ -34,6 +38,117 @@ def setup_storage():
         with open(METADATA_FILE, 'w') as f:
             json.dump({"firmware_entries": [], "latest_version": "0.0.0"}, f)
 
+    compact_metadata()
+
+# Parse a version string for comparison, dropping trailing zeros so that
+# "3.1.0" and "3.1" compare equal
+def parse_version(version_string):
+    parts = [int(x) for x in version_string.split('.')]
+    while parts and parts[-1] == 0:
+        parts.pop()
+    return tuple(parts)
+
+# Replay entries appended by upload_firmware.py, last write wins
+def apply_metadata_log(metadata):
+    try:
+        f = open(METADATA_LOG, 'r')
+    except OSError:
+        return
+    entries = metadata["firmware_entries"]
+    index = {(e["device_type"], e["version"]): i for i, e in enumerate(entries)}
+    latest = list(parse_version(metadata["latest_version"]))
+    with f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Torn line from an interrupted append
+            key = (entry["device_type"], entry["version"])
+            i = index.get(key)
+            if i is None:
+                index[key] = len(entries)
+                entries.append(entry)
+            else:
+                entries[i] = entry
+            if entry["_vtuple"] > latest:
+                latest = entry["_vtuple"]
+                metadata["latest_version"] = entry["version"]
+
+# Write metadata.json via a temp file and rename, so it is never left half written
+def save_metadata(metadata):
+    tmp = METADATA_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(json.dumps(metadata))
+    os.rename(tmp, METADATA_FILE)
+
+# Fold the metadata log into metadata.json and remove it
+def compact_metadata():
+    try:
+        os.stat(METADATA_LOG)
+    except OSError:
+        return
+    with open(METADATA_FILE, 'r') as f:
+        metadata = json.load(f)
+    apply_metadata_log(metadata)
+    save_metadata(metadata)
+    os.remove(METADATA_LOG)
+    print("Compacted metadata log")
+
+# Copies of an entry and of the metadata without the fields derived for
+# internal use (keys starting with an underscore), as served to clients
+def public_entry(entry):
+    return {k: v for k, v in entry.items() if k[0] != '_'}
+
+def public_metadata(metadata):
+    public = {k: v for k, v in metadata.items() if k[0] != '_'}
+    public['firmware_entries'] = [public_entry(e) for e in metadata['firmware_entries']]
+    return public
+
+# Size of the metadata log, 0 when there is none
+def metadata_log_size():
+    try:
+        return os.stat(METADATA_LOG)[6]
+    except OSError:
+        return 0
+
+# Cached metadata, re-read only when the file's mtime or the log's size changes
+_METADATA_CACHE = None
+_METADATA_JSON_BYTES = None
+_METADATA_KEY = None
+_INDEX_HTML_BYTES = None
+
+# Load metadata from the cache, refreshing it from disk if needed. Entries
+# upload_firmware.py appended are replayed in memory; the log is only
+# compacted at boot, so serving a request never rewrites metadata.json.
+def load_metadata():
+    global _METADATA_CACHE, _METADATA_JSON_BYTES, _METADATA_KEY, _INDEX_HTML_BYTES
+    key = (os.stat(METADATA_FILE)[8], metadata_log_size())
+    if _METADATA_CACHE is None or key != _METADATA_KEY:
+        with open(METADATA_FILE, 'r') as f:
+            metadata = json.load(f)
+        apply_metadata_log(metadata)
+        _METADATA_JSON_BYTES = json.dumps(public_metadata(metadata)).encode()
+        _INDEX_HTML_BYTES = render_index(metadata)
+        _METADATA_CACHE = metadata
+        _METADATA_KEY = key
+    return _METADATA_CACHE
+
+# Render the status page, one part per entry joined once
+def render_index(metadata):
+    parts = [
+        HTTP_200,
+        b"Content-Type: text/html\r\n\r\n",
+        b"<html><body><h1>FOTA Server</h1>",
+        f"<p>Latest version: {metadata['latest_version']}</p>".encode(),
+        f"<p>Available firmware: {len(metadata['firmware_entries'])}</p>".encode(),
+        b"</body></html>",
+        b"<h2>Available Firmware Files:</h2><ul>",
+    ]
+    for entry in metadata['firmware_entries']:
+        parts.append(f"<li>{entry['device_type']} v{entry['version']} - {entry['description']} ({entry['size']} bytes)</li>".encode())
+    parts.append(b"</ul></body></html>")
+    return b"".join(parts)
+
 # Connect to WiFi
 def connect_wifi():
     wlan = network.WLAN(network.STA_IF)
@@ -58,25 +173,35 @@ def connect_wifi():
         print("Connection failed!")
         return None
 
+# Only these headers are ever looked at, the rest are skipped undecoded
+_WANTED_HEADERS = {b'authorization', b'content-length', b'content-type'}
+
 # Parse request
 def parse_request(request):
-    lines = request.split(b'\r\n')
-    if not lines:
-        return None, None, None, None
+    first_crlf = request.find(b'\r\n')
+    if first_crlf < 0:
+        first_crlf = len(request)
+    hdr_end = request.find(b'\r\n\r\n')
+    if hdr_end < 0:
+        hdr_end = len(request)
 
-    request_line = lines[0].decode()
-    parts = request_line.split()
+    parts = request[:first_crlf].decode().split()
     if len(parts) < 3:
         return None, None, None, None
 
     method, path, _ = parts
     headers = {}
-    for line in lines[1:]:
-        if b":" in line:
-            key, value = line.decode().split(":", 1)
-            headers[key.strip().lower()] = value.strip()
-        if line == b"":
-            break
+    pos = first_crlf + 2
+    while pos < hdr_end:
+        eol = request.find(b'\r\n', pos, hdr_end)
+        if eol < 0:
+            eol = hdr_end
+        colon = request.find(b':', pos, eol)
+        if colon > pos:
+            key = request[pos:colon].strip().lower()
+            if key in _WANTED_HEADERS:
+                headers[key.decode()] = request[colon + 1:eol].decode().strip()
+        pos = eol + 2
 
     query_params = {}
     if '?' in path:
@@ -88,19 +213,12 @@ def parse_request(request):
 
     return method, path, headers, query_params
 
+# Expected Authorization header value, computed once from the credentials
+_EXPECTED_AUTH = 'Basic ' + binascii.b2a_base64(f"{API_USERNAME}:{API_PASSWORD}".encode()).decode().strip()
+
 # Basic Auth check
 def check_auth(headers):
-    if 'authorization' in headers:
-        auth = headers['authorization']
-        if auth.startswith('Basic '):
-            import ubinascii
-            try:
-                decoded = ubinascii.a2b_base64(auth[6:]).decode()
-                username, password = decoded.split(':', 1)
-                return username == API_USERNAME and password == API_PASSWORD
-            except:
-                pass
-    return False
+    return headers.get('authorization') == _EXPECTED_AUTH
 
 # HTTP Status
 HTTP_200 = b"HTTP/1.1 200 OK\r\n"
@@ -108,110 +226,205 @@ HTTP_401 = b"HTTP/1.1 401 Unauthorized\r\n"
 HTTP_404 = b"HTTP/1.1 404 Not Found\r\n"
 HTTP_500 = b"HTTP/1.1 500 Internal Server Error\r\n"
 
-# Handle requests
-def handle_request(client_socket):
+# Complete 401 response, sent as a single write
+HTTP_401_FULL = (HTTP_401 +
+                 b"WWW-Authenticate: Basic realm=\"FOTA Server\"\r\n"
+                 b"Content-Type: text/plain\r\n\r\nAuthentication required")
+
+# Pre-encoded header blocks and complete fixed responses
+_OCTET_HDR = b"Content-Type: application/octet-stream\r\n"
+_JSON_HDR = b"Content-Type: application/json\r\n\r\n"
+_TXT_404 = HTTP_404 + b"Content-Type: text/plain\r\n\r\nFile not found"
+_TXT_404_ENDPOINT = HTTP_404 + b"Content-Type: text/plain\r\n\r\nEndpoint not found"
+_TXT_500 = HTTP_500 + b"Content-Type: text/plain\r\n\r\nInternal Server Error"
+_TXT_500_INTERNAL = HTTP_500 + b"Content-Type: text/plain\r\n\r\nInternal error"
+
+# Reusable transfer buffer, so streaming a file does not allocate per chunk
+_XFER_BUF = bytearray(4096)
+_XFER_MV = memoryview(_XFER_BUF)
+
+# Receive buffers, one per open connection and pooled for reuse; the size
+# also caps how much of a request is buffered
+REQ_BUF_SIZE = 2048
+_REQ_POOL = []
+
+# Disable Nagle and enlarge the send buffer where the port allows it
+def tune_client(client):
+    nodelay = getattr(socket, 'TCP_NODELAY', None)
+    try:
+        if nodelay is not None:
+            client.setsockopt(socket.IPPROTO_TCP, nodelay, 1)
+    except (OSError, AttributeError):
+        pass
+    try:
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16384)
+    except (OSError, AttributeError):
+        pass
+
+# Send the next chunk of a streamed file; returns True once it is done
+def send_chunk(client_socket, stream):
+    # Pending headers go out in the same write as the next chunk
+    head = stream['head']
+    h = len(head)
+    _XFER_BUF[:h] = head
+    n = h + stream['file'].readinto(_XFER_MV[h:])
+    if not n:
+        return True
+    try:
+        sent = client_socket.send(_XFER_MV[:n])
+    except OSError as e:
+        if e.args[0] != errno.EAGAIN:
+            raise
+        sent = 0
+    # Keep what did not fit: the rest of the headers, and rewind the file
+    stream['head'] = head[sent:] if sent < h else b""
+    if sent < n:
+        stream['file'].seek(max(sent, h) - n, 1)
+    return False
+
+# Handle requests. File responses are returned as a stream for run_server
+# to send as the socket becomes writable; everything else is sent here.
+def handle_request(client_socket, method, path, headers, query_params):
+    stream = None
     try:
-        request = client_socket.recv(1024)
-        method, path, headers, query_params = parse_request(request)
         if not method:
-            client_socket.send(HTTP_404)
-            client_socket.close()
+            client_socket.sendall(HTTP_404)
             return
 
         print(f"Request: {method} {path}")
 
         if not (path.startswith('/download/') or path == '/firmware/metadata.json') and not check_auth(headers):
-            client_socket.send(HTTP_401)
-            client_socket.send(b"WWW-Authenticate: Basic realm=\"FOTA Server\"\r\n")
-            client_socket.send(b"Content-Type: text/plain\r\n\r\nAuthentication required")
-            client_socket.close()
+            client_socket.sendall(HTTP_401_FULL)
             return
 
         if path == '/':
-            with open(METADATA_FILE, 'r') as f:
-                metadata = json.load(f)
-            response = HTTP_200
-            response += b"Content-Type: text/html\r\n\r\n"
-            response += b"<html><body><h1>FOTA Server</h1>"
-            response += f"<p>Latest version: {metadata['latest_version']}</p>".encode()
-            response += f"<p>Available firmware: {len(metadata['firmware_entries'])}</p>".encode()
-            response += b"</body></html>"
-            #client_socket.send(response)
-            response += b"<h2>Available Firmware Files:</h2><ul>"
-            
-            for entry in metadata['firmware_entries']:
-                response += f"<li>{entry['device_type']} v{entry['version']} - {entry['description']} ({entry['size']} bytes)</li>".encode()
-            
-            response += b"</ul></body></html>"
-            client_socket.send(response)
+            load_metadata()
+            client_socket.sendall(_INDEX_HTML_BYTES)
 
         elif path == '/api/firmware/list':
-            with open(METADATA_FILE, 'r') as f:
-                metadata = json.load(f)
-            response = HTTP_200
-            response += b"Content-Type: application/json\r\n\r\n"
-            response += json.dumps(metadata).encode()
-            client_socket.send(response)
+            load_metadata()
+            client_socket.sendall(HTTP_200 + _JSON_HDR + _METADATA_JSON_BYTES)
 
         elif path == '/firmware/metadata.json':
             try:
-                with open(METADATA_FILE, 'r') as f:
-                    data = f.read()
-                response = HTTP_200
-                response += b"Content-Type: application/json\r\n\r\n"
-                response += data.encode() if isinstance(data, str) else data
-                client_socket.send(response)
+                load_metadata()  # Includes entries still in the log
+                client_socket.sendall(HTTP_200 + b"Content-Type: application/json\r\nContent-Length: " +
+                                      str(len(_METADATA_JSON_BYTES)).encode() + b"\r\n\r\n" + _METADATA_JSON_BYTES)
             except Exception as e:
                 print(f"Error serving metadata: {e}")
-                response = HTTP_500
-                response += b"Content-Type: text/plain\r\n\r\nInternal Server Error"
-                client_socket.send(response)
+                client_socket.sendall(_TXT_500)
 
         elif path.startswith('/download/'):
             filename = path[10:]
             filepath = f"{FIRMWARE_DIR}/{filename}"
             try:
                 size = os.stat(filepath)[6]
-                response = HTTP_200
-                response += f"Content-Length: {size}\r\n".encode()
-                response += b"Content-Type: application/octet-stream\r\n\r\n"
-                client_socket.send(response)
-                with open(filepath, 'rb') as f:
-                    chunk = f.read(1024)
-                    while chunk:
-                        client_socket.send(chunk)
-                        chunk = f.read(1024)
+                response = HTTP_200 + _OCTET_HDR + b"Content-Length: " + str(size).encode() + b"\r\n\r\n"
+                stream = {'head': response, 'file': open(filepath, 'rb')}
             except:
-                response = HTTP_404
-                response += b"Content-Type: text/plain\r\n\r\nFile not found"
-                client_socket.send(response)
+                client_socket.sendall(_TXT_404)
 
         else:
-            response = HTTP_404
-            response += b"Content-Type: text/plain\r\n\r\nEndpoint not found"
-            client_socket.send(response)
+            client_socket.sendall(_TXT_404_ENDPOINT)
 
     except Exception as e:
         print(f"Error: {e}")
-        response = HTTP_500
-        response += b"Content-Type: text/plain\r\n\r\nInternal error"
-        client_socket.send(response)
-    finally:
-        client_socket.close()
+        client_socket.sendall(_TXT_500_INTERNAL)
+    return stream
+
+# Account for n bytes read into the connection's buffer; once the headers,
+# and any body announced by Content-Length, are in, handle the request and return True
+def receive_request(client_socket, conn, n):
+    mv = conn['buf']
+    start = conn['fill']
+    fill = conn['fill'] = start + n
+    if conn['parsed'] is None:
+        # Only the new bytes, and the three before them, can end the headers
+        lo = max(start - 3, 0)
+        found = bytes(mv[lo:fill]).find(b'\r\n\r\n')
+        if found < 0 and fill < len(mv):
+            return False
+        hdr_end = lo + found if found >= 0 else fill
+        conn['parsed'] = parse_request(bytes(mv[:fill]))
+        method, path, headers, query_params = conn['parsed']
+        length = int(headers.get('content-length', 0)) if method else 0
+        conn['need'] = min(hdr_end + 4 + length, len(mv))
+    if fill < conn['need']:
+        return False
+    method, path, headers, query_params = conn['parsed']
 
-# Main server loop
+    # Small responses are written straight away, with a bounded wait
+    client_socket.settimeout(CONN_TIMEOUT_MS / 1000)
+    conn['stream'] = handle_request(client_socket, method, path, headers, query_params)
+    client_socket.setblocking(False)
+    return True
+
+# Forget a connection and close its socket and any file being streamed
+def close_conn(poller, conns, client):
+    conn = conns.pop(client)
+    poller.unregister(client)
+    _REQ_POOL.append(conn['buf'])
+    if conn['stream']:
+        conn['stream']['file'].close()
+    client.close()
+    LED.value(1)
+
+# Main server loop: one poller multiplexes accepts, request reads and
+# file streaming, so a slow client cannot hold up the others
 def run_server(ip):
     sock = socket.socket()
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     sock.bind(('0.0.0.0', SERVER_PORT))
     sock.listen(5)
+    sock.setblocking(False)
+    poller = select.poll()
+    poller.register(sock, select.POLLIN)
+    conns = {}
     print(f"FOTA server running on http://{ip}:{SERVER_PORT}")
+
     while True:
-        client, addr = sock.accept()
-        print(f"Client connected: {addr}")
-        LED.toggle()
-        handle_request(client)
-        LED.value(1)
+        for client, event in poller.poll(1000):
+            if client is sock:
+                try:
+                    client, addr = sock.accept()
+                except OSError:
+                    continue
+                print(f"Client connected: {addr}")
+                LED.toggle()
+                client.setblocking(False)
+                tune_client(client)
+                poller.register(client, select.POLLIN)
+                buf = _REQ_POOL.pop() if _REQ_POOL else memoryview(bytearray(REQ_BUF_SIZE))
+                conns[client] = {'buf': buf, 'fill': 0, 'parsed': None, 'need': 0, 'stream': None, 'last': time.ticks_ms()}
+                continue
+
+            conn = conns.get(client)
+            if conn is None:
+                continue
+            conn['last'] = time.ticks_ms()
+            try:
+                if not event & (select.POLLIN | select.POLLOUT):
+                    close_conn(poller, conns, client)  # POLLHUP or POLLERR
+                elif conn['stream']:
+                    if send_chunk(client, conn['stream']):
+                        close_conn(poller, conns, client)
+                else:
+                    n = client.readinto(conn['buf'][conn['fill']:])
+                    if n == 0:
+                        close_conn(poller, conns, client)
+                    elif n and receive_request(client, conn, n):
+                        if conn['stream']:
+                            poller.modify(client, select.POLLOUT)
+                        else:
+                            close_conn(poller, conns, client)
+            except Exception as e:
+                print(f"Error: {e}")
+                close_conn(poller, conns, client)
+
+        # Drop connections that have gone quiet
+        now = time.ticks_ms()
+        for client in [c for c, conn in conns.items() if time.ticks_diff(now, conn['last']) > CONN_TIMEOUT_MS]:
+            close_conn(poller, conns, client)
 
 # Start app
 def main():
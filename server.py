@@ -1,6 +1,8 @@
 import os
 import json
 import time
+import errno
+import select
 import network
 import socket
 import binascii
@@ -11,6 +13,7 @@ from machine import Pin
 WIFI_SSID = "GEARBOX EUROPLACER"
 WIFI_PASS = "Euro@2023"
 SERVER_PORT = 80
+CONN_TIMEOUT_MS = 10000  # Drop clients that stall longer than this
 API_USERNAME = "admin"
 API_PASSWORD = "admin"
 LED = Pin("LED", Pin.OUT)  # Onboard LED for status indication
@@ -18,6 +21,7 @@ LED = Pin("LED", Pin.OUT)  # Onboard LED for status indication
 # Directory structure
 FIRMWARE_DIR = "/firmware"
 METADATA_FILE = "/firmware/metadata.json"
+METADATA_LOG = "/firmware/metadata.json.log"
 
 # Ensure firmware directory exists
 def setup_storage():
@@ -27,13 +31,159 @@ def setup_storage():
         # Directory already exists
         pass
     
-    # Create metadata file if it doesn't exist
-    if METADATA_FILE not in os.listdir(FIRMWARE_DIR):
+    # Create metadata file if it doesn't exist. A single stat, since
+    # os.listdir() returns bare names and never matched the full path.
+    try:
+        os.stat(METADATA_FILE)
+    except OSError:
         with open(METADATA_FILE, 'w') as f:
             json.dump({
                 "firmware_entries": [],
                 "latest_version": "0.0.0"
             }, f)
+    
+    # Apply firmware uploaded since the last boot
+    compact_metadata()
+
+# Replay entries appended by upload_firmware.py, last write wins
+def apply_metadata_log(metadata):
+    try:
+        f = open(METADATA_LOG, 'r')
+    except OSError:
+        return
+    entries = metadata["firmware_entries"]
+    index = {(e["device_type"], e["version"]): i for i, e in enumerate(entries)}
+    latest = list(parse_version(metadata["latest_version"]))
+    with f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Torn line from an interrupted append
+            key = (entry["device_type"], entry["version"])
+            i = index.get(key)
+            if i is None:
+                index[key] = len(entries)
+                entries.append(entry)
+            else:
+                entries[i] = entry
+            if entry["_vtuple"] > latest:
+                latest = entry["_vtuple"]
+                metadata["latest_version"] = entry["version"]
+
+# Append an entry to the metadata log as one line. A torn line left by an
+# interrupted append is terminated first, so only that line is lost.
+def append_metadata_log(entry):
+    try:
+        with open(METADATA_LOG, 'rb') as f:
+            f.seek(-1, 2)
+            last = f.read(1)
+    except OSError:
+        last = b"\n"  # No log yet, or an empty one
+    with open(METADATA_LOG, 'a') as f:
+        if last != b"\n":
+            f.write("\n")
+        f.write(json.dumps(entry) + "\n")
+
+# Replace metadata.json atomically. The document is written in one go to
+# a temporary file that is then renamed over the old one, so losing power
+# mid-write leaves the previous metadata intact.
+def save_metadata(metadata):
+    tmp = METADATA_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(json.dumps(metadata))
+    os.rename(tmp, METADATA_FILE)
+
+# Fold the metadata log into metadata.json and remove it
+def compact_metadata():
+    try:
+        os.stat(METADATA_LOG)
+    except OSError:
+        return
+    with open(METADATA_FILE, 'r') as f:
+        metadata = json.load(f)
+    apply_metadata_log(metadata)
+    save_metadata(metadata)
+    os.remove(METADATA_LOG)
+    print("Compacted metadata log")
+
+# Copies of an entry and of the metadata without the fields derived for
+# internal use (keys starting with an underscore), as served to clients
+def public_entry(entry):
+    return {k: v for k, v in entry.items() if k[0] != '_'}
+
+def public_metadata(metadata):
+    public = {k: v for k, v in metadata.items() if k[0] != '_'}
+    public['firmware_entries'] = [public_entry(e) for e in metadata['firmware_entries']]
+    return public
+
+# Size of the metadata log, 0 when there is none
+def metadata_log_size():
+    try:
+        return os.stat(METADATA_LOG)[6]
+    except OSError:
+        return 0
+
+# Cached metadata, re-read when metadata.json's mtime or the log's size changes
+_METADATA_CACHE = None
+_METADATA_JSON_BYTES = None
+_METADATA_KEY = None
+_INDEX_HTML_BYTES = None
+_LATEST_BY_DEVICE = {}
+
+# Load metadata from the cache, refreshing it from disk if needed
+def load_metadata():
+    global _METADATA_CACHE, _METADATA_JSON_BYTES, _METADATA_KEY, _INDEX_HTML_BYTES, _LATEST_BY_DEVICE
+    
+    # The log only grows between compactions, so its size changes whenever
+    # upload_firmware.py appends an entry. Pending entries are replayed in
+    # memory; the log is folded into metadata.json only at boot, keeping
+    # requests from rewriting the file.
+    key = (os.stat(METADATA_FILE)[8], metadata_log_size())
+    if _METADATA_CACHE is None or key != _METADATA_KEY:
+        with open(METADATA_FILE, 'r') as f:
+            metadata = json.load(f)
+        apply_metadata_log(metadata)
+        
+        # Older entries may not carry a precomputed version tuple yet
+        for entry in metadata['firmware_entries']:
+            if '_vtuple' not in entry:
+                entry['_vtuple'] = list(parse_version(entry['version']))
+        _METADATA_JSON_BYTES = json.dumps(public_metadata(metadata)).encode()
+        
+        # Index the serialized latest entry per device type
+        latest = {}
+        latest_version = {}
+        for entry in metadata['firmware_entries']:
+            device_type = entry['device_type']
+            version = tuple(entry['_vtuple'])
+            best = latest_version.get(device_type)
+            if best is None or version > best:
+                latest_version[device_type] = version
+                latest[device_type] = entry
+        _LATEST_BY_DEVICE = {k: json.dumps(public_entry(v)).encode() for k, v in latest.items()}
+        _INDEX_HTML_BYTES = render_index(metadata)
+        _METADATA_CACHE = metadata
+        _METADATA_KEY = key
+    return _METADATA_CACHE
+
+# Render the root status page once per metadata change
+def render_index(metadata):
+    parts = [
+        HTTP_200,
+        b"Content-Type: text/html\r\n\r\n",
+        b"<html><body><h1>FOTA Server</h1>",
+        f"<p>Latest version: {metadata['latest_version']}</p>".encode(),
+        f"<p>Available firmware: {len(metadata['firmware_entries'])}</p>".encode(),
+        b"<h2>Available Firmware Files:</h2><ul>",
+    ]
+    
+    # Collect the parts and join once, rather than growing a bytes object
+    for entry in metadata['firmware_entries']:
+        parts.append(f"<li>{entry['device_type']} v{entry['version']} - {entry['description']} ({entry['size']} bytes)</li>".encode())
+    
+    parts.append(b"</ul></body></html>")
+    return b"".join(parts)
 
 # Connect to WiFi
 def connect_wifi():
@@ -63,95 +213,90 @@ def connect_wifi():
         print("Connection failed!")
         return None
 
-# Calculate MD5 hash of a file
-def calculate_md5(filename):
-    with open(filename, 'rb') as f:
-        file_hash = hashlib.md5()
-        chunk = f.read(1024)
-        while chunk:
-            file_hash.update(chunk)
-            chunk = f.read(1024)
-    return binascii.hexlify(file_hash.digest()).decode()
+# Helper function to compare version strings. Trailing zeros are dropped
+# so that "3.1.0" and "3.1" compare equal.
+def parse_version(version_string):
+    parts = [int(x) for x in version_string.split('.')]
+    while parts and parts[-1] == 0:
+        parts.pop()
+    return tuple(parts)
 
 # Add new firmware to the repository
 def add_firmware(filename, version, device_type, description=""):
     # Copy file to firmware directory with version in filename
-    base_name = os.path.basename(filename)
-    extension = base_name.split('.')[-1]
-    new_filename = f"{FIRMWARE_DIR}/{device_type}-v{version}.{extension}"
-    
-    # Read source file
-    with open(filename, 'rb') as src:
-        data = src.read()
-    
-    # Write to destination
-    with open(new_filename, 'wb') as dst:
-        dst.write(data)
+    # MicroPython has no os.path, so slice at the last separator and dot
+    base_name = filename[filename.rfind('/') + 1:]
+    extension = base_name[base_name.rfind('.') + 1:]
+    stored_name = f"{device_type}-v{version}.{extension}"
+    new_filename = f"{FIRMWARE_DIR}/{stored_name}"
     
-    # Calculate MD5 hash
-    md5_hash = calculate_md5(new_filename)
+    # Copy through the shared transfer buffer, never holding the whole image,
+    # and hash each chunk as it is written
+    file_hash = hashlib.md5()
+    with open(filename, 'rb') as src, open(new_filename, 'wb') as dst:
+        while True:
+            n = src.readinto(_XFER_BUF)
+            if not n:
+                break
+            chunk = _XFER_MV[:n]
+            dst.write(chunk)
+            file_hash.update(chunk)
+    md5_hash = binascii.hexlify(file_hash.digest()).decode()
     file_size = os.stat(new_filename)[6]  # Get file size
     
-    # Update metadata
-    with open(METADATA_FILE, 'r') as f:
-        metadata = json.load(f)
-    
-    # Add new firmware entry
+    # Record the new entry
     firmware_entry = {
         "version": version,
         "device_type": device_type,
-        "filename": os.path.basename(new_filename),
+        "filename": stored_name,
         "size": file_size,
         "md5": md5_hash,
         "description": description,
-        "upload_date": time.time()
+        "upload_date": time.time(),
+        "_vtuple": list(parse_version(version))
     }
     
-    # Check if this version already exists
-    for i, entry in enumerate(metadata["firmware_entries"]):
-        if entry["version"] == version and entry["device_type"] == device_type:
-            # Replace existing entry
-            metadata["firmware_entries"][i] = firmware_entry
-            break
-    else:
-        # Add new entry
-        metadata["firmware_entries"].append(firmware_entry)
-    
-    # Update latest version if newer
-    from pkg_resources import parse_version
-    if parse_version(version) > parse_version(metadata["latest_version"]):
-        metadata["latest_version"] = version
-    
-    # Write updated metadata
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f)
+    # Append to the metadata log like upload_firmware.py does, rather than
+    # rewriting metadata.json. Replaying the log replaces an existing entry
+    # for this version and updates latest_version; the growing log also
+    # invalidates the cached metadata.
+    append_metadata_log(firmware_entry)
     
     return True
 
+# Only these headers are ever looked at, the rest are skipped undecoded
+_WANTED_HEADERS = {b'authorization', b'content-length', b'content-type'}
+
 # Parse HTTP request
 def parse_request(request):
-    # Split request into lines
-    lines = request.split(b'\r\n')
-    if not lines:
-        return None, None, None, None
+    # Locate the end of the request line and of the header block
+    first_crlf = request.find(b'\r\n')
+    if first_crlf < 0:
+        first_crlf = len(request)
+    hdr_end = request.find(b'\r\n\r\n')
+    if hdr_end < 0:
+        hdr_end = len(request)
     
     # Parse request line
-    request_line = lines[0].decode()
-    parts = request_line.split()
+    parts = request[:first_crlf].decode().split()
     if len(parts) < 3:
         return None, None, None, None
     
     method, path, _ = parts
     
-    # Parse headers
+    # Parse headers in place, decoding only the ones we use
     headers = {}
-    for i in range(1, len(lines)):
-        line = lines[i].decode()
-        if not line:
-            break
-        if ':' in line:
-            key, value = line.split(':', 1)
-            headers[key.strip().lower()] = value.strip()
+    pos = first_crlf + 2
+    while pos < hdr_end:
+        eol = request.find(b'\r\n', pos, hdr_end)
+        if eol < 0:
+            eol = hdr_end
+        colon = request.find(b':', pos, eol)
+        if colon > pos:
+            key = request[pos:colon].strip().lower()
+            if key in _WANTED_HEADERS:
+                headers[key.decode()] = request[colon + 1:eol].decode().strip()
+        pos = eol + 2
     
     # Parse query parameters
     query_params = {}
@@ -164,108 +309,122 @@ def parse_request(request):
     
     return method, path, headers, query_params
 
+# Expected Authorization header value, computed once from the credentials
+_EXPECTED_AUTH = 'Basic ' + binascii.b2a_base64(f"{API_USERNAME}:{API_PASSWORD}".encode()).decode().strip()
+
 # Check authentication
 def check_auth(headers):
     # Extremely basic auth - for production, use a more secure method
-    if 'authorization' in headers:
-        auth = headers['authorization']
-        if auth.startswith('Basic '):
-            import ubinascii
-            try:
-                decoded = ubinascii.a2b_base64(auth[6:]).decode()
-                username, password = decoded.split(':', 1)
-                if username == API_USERNAME and password == API_PASSWORD:
-                    return True
-            except:
-                pass
-    return False
+    return headers.get('authorization') == _EXPECTED_AUTH
 
 # HTTP status codes
 HTTP_200 = b"HTTP/1.1 200 OK\r\n"
+HTTP_400 = b"HTTP/1.1 400 Bad Request\r\n\r\n"
 HTTP_401 = b"HTTP/1.1 401 Unauthorized\r\n"
 HTTP_404 = b"HTTP/1.1 404 Not Found\r\n"
 HTTP_500 = b"HTTP/1.1 500 Internal Server Error\r\n"
 
-# Handle client request
-def handle_request(client_socket):
+# Complete 401 response, sent as a single write
+HTTP_401_FULL = (HTTP_401 +
+                 b"WWW-Authenticate: Basic realm=\"FOTA Server\"\r\n"
+                 b"Content-Type: text/plain\r\n\r\nAuthentication required")
+
+# Header blocks and fixed responses, encoded once at import
+_OCTET_HDR = b"Content-Type: application/octet-stream\r\n"
+_JSON_HDR = b"Content-Type: application/json\r\n\r\n"
+_TXT_404 = HTTP_404 + b"Content-Type: text/plain\r\n\r\nFile not found"
+_TXT_404_ENDPOINT = HTTP_404 + b"Content-Type: text/plain\r\n\r\nEndpoint not found"
+_JSON_404_LATEST = HTTP_404 + _JSON_HDR + b'{"error": "No firmware found for specified device type"}'
+
+# Reusable transfer buffer, so streaming a file does not allocate per chunk
+_XFER_BUF = bytearray(4096)
+_XFER_MV = memoryview(_XFER_BUF)
+
+# Receive buffers, one per open connection, handed back to the pool when it
+# closes so they are allocated only once. The size caps how much of a
+# request is buffered.
+REQ_BUF_SIZE = 2048
+_REQ_POOL = []
+
+# Tune a freshly accepted client socket for streaming downloads.
+# Not every MicroPython port exposes these options, so each is optional.
+def tune_client(client_socket):
+    # Send each chunk straight away instead of waiting on delayed ACKs
+    nodelay = getattr(socket, 'TCP_NODELAY', None)
+    try:
+        if nodelay is not None:
+            client_socket.setsockopt(socket.IPPROTO_TCP, nodelay, 1)
+    except (OSError, AttributeError):
+        pass
+    
+    # A larger send buffer lets several chunks fill full-size segments
+    try:
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16384)
+    except (OSError, AttributeError):
+        pass
+
+# Send the next chunk of a streamed file; returns True once it is done
+def send_chunk(client_socket, stream):
+    # Pending headers go out in the same write as the next chunk
+    head = stream['head']
+    h = len(head)
+    _XFER_BUF[:h] = head
+    n = h + stream['file'].readinto(_XFER_MV[h:])
+    if not n:
+        return True
+    
+    try:
+        sent = client_socket.send(_XFER_MV[:n])
+    except OSError as e:
+        if e.args[0] != errno.EAGAIN:
+            raise
+        sent = 0
+    
+    # Keep what did not fit: the rest of the headers, and rewind the file
+    stream['head'] = head[sent:] if sent < h else b""
+    if sent < n:
+        stream['file'].seek(max(sent, h) - n, 1)
+    return False
+
+# Handle client request. Downloads are returned as a stream for run_server
+# to send as the socket becomes writable; everything else is sent here.
+def handle_request(client_socket, method, path, headers, query_params):
+    stream = None
     try:
-        # Receive client request
-        request = client_socket.recv(1024)
-        
-        # Parse request
-        method, path, headers, query_params = parse_request(request)
         if not method:
-            client_socket.send(HTTP_400)
-            client_socket.close()
+            client_socket.sendall(HTTP_400)
             return
         
         print(f"Request: {method} {path}")
         
         # Check authentication for all requests except firmware downloads
         if not path.startswith('/download/') and not check_auth(headers):
-            client_socket.send(HTTP_401)
-            client_socket.send(b"WWW-Authenticate: Basic realm=\"FOTA Server\"\r\n")
-            client_socket.send(b"Content-Type: text/plain\r\n\r\n")
-            client_socket.send(b"Authentication required")
-            client_socket.close()
+            client_socket.sendall(HTTP_401_FULL)
             return
             
         # API endpoints
         if path == '/':
             # Root endpoint - basic status page
-            with open(METADATA_FILE, 'r') as f:
-                metadata = json.load(f)
-            
-            response = HTTP_200
-            response += b"Content-Type: text/html\r\n\r\n"
-            response += b"<html><body><h1>FOTA Server</h1>"
-            response += f"<p>Latest version: {metadata['latest_version']}</p>".encode()
-            response += f"<p>Available firmware: {len(metadata['firmware_entries'])}</p>".encode()
-            response += b"<h2>Available Firmware Files:</h2><ul>"
-            
-            for entry in metadata['firmware_entries']:
-                response += f"<li>{entry['device_type']} v{entry['version']} - {entry['description']} ({entry['size']} bytes)</li>".encode()
-            
-            response += b"</ul></body></html>"
-            client_socket.send(response)
+            load_metadata()
+            client_socket.sendall(_INDEX_HTML_BYTES)
             
         elif path == '/api/firmware/list':
-            # List all available firmware
-            with open(METADATA_FILE, 'r') as f:
-                metadata = json.load(f)
-            
-            response = HTTP_200
-            response += b"Content-Type: application/json\r\n\r\n"
-            response += json.dumps(metadata).encode()
-            client_socket.send(response)
+            # List all available firmware, pre-serialized by load_metadata()
+            load_metadata()
+            client_socket.sendall(HTTP_200 + _JSON_HDR + _METADATA_JSON_BYTES)
             
         elif path == '/api/firmware/latest':
             # Get latest firmware for device type
             device_type = query_params.get('device_type', '')
+            load_metadata()
+            body = _LATEST_BY_DEVICE.get(device_type)
             
-            with open(METADATA_FILE, 'r') as f:
-                metadata = json.load(f)
-            
-            # Find latest version for this device type
-            latest_version = "0.0.0"
-            latest_entry = None
-            
-            for entry in metadata['firmware_entries']:
-                if entry['device_type'] == device_type:
-                    if parse_version(entry['version']) > parse_version(latest_version):
-                        latest_version = entry['version']
-                        latest_entry = entry
-            
-            if latest_entry:
-                response = HTTP_200
-                response += b"Content-Type: application/json\r\n\r\n"
-                response += json.dumps(latest_entry).encode()
+            if body:
+                response = HTTP_200 + _JSON_HDR + body
             else:
-                response = HTTP_404
-                response += b"Content-Type: application/json\r\n\r\n"
-                response += json.dumps({"error": "No firmware found for specified device type"}).encode()
+                response = _JSON_404_LATEST
             
-            client_socket.send(response)
+            client_socket.sendall(response)
             
         elif path.startswith('/download/'):
             # Download firmware file
@@ -275,46 +434,74 @@ def handle_request(client_socket):
             try:
                 file_size = os.stat(filepath)[6]
                 
-                response = HTTP_200
-                response += f"Content-Type: application/octet-stream\r\n".encode()
-                response += f"Content-Length: {file_size}\r\n".encode()
-                response += f"Content-Disposition: attachment; filename=\"{filename}\"\r\n\r\n".encode()
-                client_socket.send(response)
+                # Only the size and filename differ between downloads
+                response = (HTTP_200 + _OCTET_HDR +
+                            b"Content-Length: " + str(file_size).encode() +
+                            b"\r\nContent-Disposition: attachment; filename=\"" + filename.encode() + b"\"\r\n\r\n")
                 
-                # Send file in chunks
-                with open(filepath, 'rb') as f:
-                    chunk = f.read(1024)
-                    while chunk:
-                        client_socket.send(chunk)
-                        chunk = f.read(1024)
+                # The file itself is sent in chunks by run_server
+                stream = {'head': response, 'file': open(filepath, 'rb')}
             except OSError:
-                response = HTTP_404
-                response += b"Content-Type: text/plain\r\n\r\n"
-                response += b"File not found"
-                client_socket.send(response)
+                client_socket.sendall(_TXT_404)
         
         else:
             # 404 Not Found
-            response = HTTP_404
-            response += b"Content-Type: text/plain\r\n\r\n"
-            response += b"Endpoint not found"
-            client_socket.send(response)
+            client_socket.sendall(_TXT_404_ENDPOINT)
     
     except Exception as e:
         # 500 Internal Server Error
         print(f"Error handling request: {e}")
         try:
-            response = HTTP_500
-            response += b"Content-Type: text/plain\r\n\r\n"
-            response += f"Internal server error: {str(e)}".encode()
-            client_socket.send(response)
+            client_socket.sendall(HTTP_500 + b"Content-Type: text/plain\r\n\r\nInternal server error: " + str(e).encode())
         except:
             pass
     
-    finally:
-        client_socket.close()
+    return stream
 
-# Main server loop
+# Account for n bytes read into the connection's buffer; once the headers,
+# and any body announced by Content-Length, are in, handle the request and
+# return True
+def receive_request(client_socket, conn, n):
+    mv = conn['buf']
+    start = conn['fill']
+    fill = conn['fill'] = start + n
+    
+    if conn['parsed'] is None:
+        # Wait for the end of the headers, unless the buffer limit is reached.
+        # Only the new bytes, and the three before them, can complete it.
+        lo = max(start - 3, 0)
+        found = bytes(mv[lo:fill]).find(b'\r\n\r\n')
+        if found < 0 and fill < len(mv):
+            return False
+        hdr_end = lo + found if found >= 0 else fill
+        
+        # Parse once; a body announced by Content-Length may still be due
+        conn['parsed'] = parse_request(bytes(mv[:fill]))
+        method, path, headers, query_params = conn['parsed']
+        length = int(headers.get('content-length', 0)) if method else 0
+        conn['need'] = min(hdr_end + 4 + length, len(mv))
+    if fill < conn['need']:
+        return False
+    method, path, headers, query_params = conn['parsed']
+    
+    # Small responses are written straight away, with a bounded wait
+    client_socket.settimeout(CONN_TIMEOUT_MS / 1000)
+    conn['stream'] = handle_request(client_socket, method, path, headers, query_params)
+    client_socket.setblocking(False)
+    return True
+
+# Forget a connection and close its socket and any file being streamed
+def close_connection(poller, connections, client_socket):
+    conn = connections.pop(client_socket)
+    poller.unregister(client_socket)
+    _REQ_POOL.append(conn['buf'])
+    if conn['stream']:
+        conn['stream']['file'].close()
+    client_socket.close()
+    LED.value(1)  # Turn LED back on
+
+# Main server loop. A single poller multiplexes new connections, request
+# reads and download streaming, so one slow client cannot stall the rest.
 def run_server(ip):
     # Create socket
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -323,25 +510,68 @@ def run_server(ip):
     try:
         server_socket.bind(('0.0.0.0', SERVER_PORT))
         server_socket.listen(5)
+        server_socket.setblocking(False)
         print(f"FOTA server running on http://{ip}:{SERVER_PORT}")
         
+        poller = select.poll()
+        poller.register(server_socket, select.POLLIN)
+        connections = {}
+        
         while True:
-            try:
-                client_socket, addr = server_socket.accept()
-                print(f"Client connected from {addr[0]}:{addr[1]}")
-                LED.toggle()  # Blink LED on connection
-                handle_request(client_socket)
-                LED.value(1)  # Turn LED back on
-            except Exception as e:
-                print(f"Error accepting connection: {e}")
+            for client_socket, event in poller.poll(1000):
+                # New connection
+                if client_socket is server_socket:
+                    try:
+                        client_socket, addr = server_socket.accept()
+                    except OSError as e:
+                        print(f"Error accepting connection: {e}")
+                        continue
+                    print(f"Client connected from {addr[0]}:{addr[1]}")
+                    LED.toggle()  # Blink LED on connection
+                    client_socket.setblocking(False)
+                    tune_client(client_socket)
+                    poller.register(client_socket, select.POLLIN)
+                    buf = _REQ_POOL.pop() if _REQ_POOL else memoryview(bytearray(REQ_BUF_SIZE))
+                    connections[client_socket] = {'buf': buf, 'fill': 0, 'parsed': None, 'need': 0,
+                                                  'stream': None, 'last': time.ticks_ms()}
+                    continue
+                
+                conn = connections.get(client_socket)
+                if conn is None:
+                    continue
+                conn['last'] = time.ticks_ms()
+                
+                try:
+                    if not event & (select.POLLIN | select.POLLOUT):
+                        # POLLHUP or POLLERR
+                        close_connection(poller, connections, client_socket)
+                    elif conn['stream']:
+                        # Download in progress and the socket is writable
+                        if send_chunk(client_socket, conn['stream']):
+                            close_connection(poller, connections, client_socket)
+                    else:
+                        # More of the request has arrived, read in place after what is buffered
+                        n = client_socket.readinto(conn['buf'][conn['fill']:])
+                        if n == 0:
+                            close_connection(poller, connections, client_socket)
+                        elif n and receive_request(client_socket, conn, n):
+                            if conn['stream']:
+                                poller.modify(client_socket, select.POLLOUT)
+                            else:
+                                close_connection(poller, connections, client_socket)
+                except Exception as e:
+                    print(f"Error serving client: {e}")
+                    close_connection(poller, connections, client_socket)
+            
+            # Drop connections that have gone quiet
+            now = time.ticks_ms()
+            stale = [c for c, conn in connections.items() if time.ticks_diff(now, conn['last']) > CONN_TIMEOUT_MS]
+            for client_socket in stale:
+                close_connection(poller, connections, client_socket)
     
     finally:
         server_socket.close()
 
-# Helper function to compare version strings
-def parse_version(version_string):
-    return tuple(map(int, version_string.split('.')))
-
 # Main application
 def main():
     # Initialize storage
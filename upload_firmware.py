@@ -1,16 +1,330 @@
 import os
+import sys
 import json
 import time
 import gc
+import binascii
 import struct
+from array import array
+
+try:
+    from concurrent.futures import ProcessPoolExecutor  # CPython only
+except ImportError:
+    ProcessPoolExecutor = None
+
+try:
+    import orjson  # Optional, much faster JSON on CPython
+except ImportError:
+    orjson = None
 
 # Configuration
 FIRMWARE_DIR = "/firmware"
 METADATA_FILE = "/firmware/metadata.json"
+METADATA_LOG = "/firmware/metadata.json.log"  # One JSON entry per line
+METADATA_LOG_MAX = 4096  # Fold the log into metadata.json past this size
+
+# Block size for copying and checksumming; keep it small on a Pico's RAM
+COPY_BLOCK = (1 << 20) if sys.implementation.name == "cpython" else 4096
+PARALLEL_CRC_MIN = 8 << 20  # Split larger images across processes (CPython)
 
 # ================================
 # STM32-Compatible CRC32 Function
 # ================================
+def _make_crc_table():
+    """Build the 256-entry MSB-first lookup table for polynomial 0x04C11DB7"""
+    table = array('I', bytes(1024))  # 256 zeroed entries, filled in place
+    for b in range(256):
+        crc = b << 24
+        for _ in range(8):
+            # XOR in the polynomial only when the top bit shifts out, without a branch
+            crc = ((crc << 1) & 0xFFFFFFFF) ^ (0x04C11DB7 & -(crc >> 31))
+        table[b] = crc
+    return table
+
+CRC_TABLE = None  # Built below, only for the paths that use it
+
+def _make_slice_tables(table):
+    """
+    Build the eight slice-by-8 tables: entry b of table k is the CRC of byte
+    b followed by k zero bytes, so eight bytes fold in with eight lookups.
+    """
+    tables = [table]
+    for _ in range(7):
+        prev = tables[-1]
+        nxt = array('I', bytes(1024))
+        for b in range(256):
+            v = prev[b]
+            nxt[b] = ((v << 8) & 0xFFFFFFFF) ^ table[v >> 24]
+        tables.append(nxt)
+    return tables
+
+_SLICE_TABLES = None  # Only for the pure Python path
+
+def _make_bitrev_table():
+    """Build the table mapping each byte to its bit-reversed value"""
+    table = bytearray(256)
+    for b in range(256):
+        r = 0
+        for bit in range(8):
+            if b & (1 << bit):
+                r |= 0x80 >> bit
+        table[b] = r
+    return bytes(table)
+
+_BITREV = None
+# Optional SIMD CRC32 (pycrc32 on CPython), otherwise binascii's C version
+try:
+    from pycrc32 import Hasher as _Hasher
+except ImportError:
+    _Hasher = None
+
+def _pycrc32_crc32(data, value):
+    """Same contract as binascii.crc32(data, value), backed by pycrc32"""
+    hasher = _Hasher.with_initial(value)
+    hasher.update(bytes(data))  # pycrc32 only takes bytes
+    return hasher.finalize()
+
+if _Hasher is not None:
+    _crc32 = _pycrc32_crc32
+else:
+    _crc32 = getattr(binascii, 'crc32', None)  # Not in every MicroPython build
+_crc_scratch = bytearray(0)  # Sized below when _stm32_order is the one in use
+
+def _bitrev32(x):
+    br = _BITREV
+    return (br[x & 0xFF] << 24) | (br[(x >> 8) & 0xFF] << 16) | (br[(x >> 16) & 0xFF] << 8) | br[x >> 24]
+
+def _stm32_order(data):
+    """
+    Lay data out in the scratch buffer as the reflected CRC has to see it:
+    each little-endian word MSB first, with every byte bit-reversed. A
+    trailing partial word is zero padded, so every block except the last
+    must be a multiple of 4 bytes.
+    """
+    global _crc_scratch
+    mv = memoryview(data)
+    n = len(mv)
+    size = (n + 3) & ~3
+    if len(_crc_scratch) < size:
+        _crc_scratch = bytearray(size)
+    out = _crc_scratch
+    br = _BITREV
+    
+    i = 0
+    while i + 3 < n:
+        out[i] = br[mv[i + 3]]
+        out[i + 1] = br[mv[i + 2]]
+        out[i + 2] = br[mv[i + 1]]
+        out[i + 3] = br[mv[i]]
+        i += 4
+    
+    # Zero padding is the high part of a partial word, so it goes in first
+    if i < n:
+        for k in range(4):
+            j = i + 3 - k
+            out[i + k] = br[mv[j]] if j < n else 0
+    return memoryview(out)[:size]
+
+def _stm32_order_translate(data):
+    """
+    _stm32_order for CPython, where bytes.translate and extended slices do
+    the bit reversal and word reordering in C
+    """
+    n = len(data)
+    size = (n + 3) & ~3
+    src = bytes(data).translate(_BITREV) + bytes(size - n)
+    out = bytearray(size)
+    out[0::4] = src[3::4]
+    out[1::4] = src[2::4]
+    out[2::4] = src[1::4]
+    out[3::4] = src[0::4]
+    return out
+
+class STM32CRC32:
+    """
+    Streaming STM32 CRC32, fed block by block like pycrc32.Hasher.
+
+    The STM32 shifts each little-endian word in MSB first. Reversing the
+    bits of every byte in that order turns this into the reflected CRC32
+    that pycrc32 or binascii.crc32 compute natively, so only the byte
+    shuffle runs in Python. On that path the value stays reflected between
+    blocks, where the STM32 start value 0xFFFFFFFF is simply 0, and is
+    converted once in finalize().
+    """
+    def __init__(self):
+        self._value = 0 if _REFLECTED else 0xFFFFFFFF
+    
+    def update(self, data):
+        if _REFLECTED:
+            self._value = _crc32(_order(data), self._value)
+        else:
+            self._value = (_native_update or _stm32_crc32_update_table)(self._value, data)
+    
+    def finalize(self):
+        if not _REFLECTED:
+            return self._value
+        return _bitrev32(self._value ^ 0xFFFFFFFF)
+
+def _stm32_crc32_update_table(crc, data):
+    """
+    Table-driven fallback for STM32CRC32: feeding the bytes of each
+    little-endian word in order 3, 2, 1, 0 through a byte-wise CRC.
+    """
+    table = CRC_TABLE
+    mv = memoryview(data)
+    n = len(mv)
+    i = 0
+    
+    # Slice-by-8: the STM32 XORs each little-endian word straight into the
+    # register, so two words are folded in per step
+    if _SLICE_TABLES is not None:
+        t0, t1, t2, t3, t4, t5, t6, t7 = _SLICE_TABLES
+        unpack_from = struct.unpack_from
+        while i + 7 < n:
+            # Unpack up to 256 words per call rather than two at a time
+            count = min((n - i) >> 3, 128) * 2
+            words = unpack_from('<%dI' % count, mv, i)
+            for k in range(0, count, 2):
+                x = crc ^ words[k]
+                w1 = words[k + 1]
+                crc = (t7[x >> 24] ^ t6[(x >> 16) & 0xFF] ^ t5[(x >> 8) & 0xFF] ^ t4[x & 0xFF] ^
+                       t3[w1 >> 24] ^ t2[(w1 >> 16) & 0xFF] ^ t1[(w1 >> 8) & 0xFF] ^ t0[w1 & 0xFF])
+            i += count * 4
+    
+    # Process data in 32-bit words (like STM32 HAL_CRC_Calculate)
+    while i + 3 < n:
+        crc = ((crc << 8) ^ table[(crc >> 24) ^ mv[i + 3]]) & 0xFFFFFFFF
+        crc = ((crc << 8) ^ table[(crc >> 24) ^ mv[i + 2]]) & 0xFFFFFFFF
+        crc = ((crc << 8) ^ table[(crc >> 24) ^ mv[i + 1]]) & 0xFFFFFFFF
+        crc = ((crc << 8) ^ table[(crc >> 24) ^ mv[i]]) & 0xFFFFFFFF
+        i += 4
+    
+    # Handle remaining bytes (like STM32 HAL_CRC_Accumulate for partial words)
+    if i < n:
+        # Zero padding is the high part of the word, so it goes in first
+        for j in range(i + 3, i - 1, -1):
+            byte = mv[j] if j < n else 0
+            crc = ((crc << 8) ^ table[(crc >> 24) ^ byte]) & 0xFFFFFFFF
+    return crc
+
+# Native-code CRC where the port compiles viper (RP2 and most others). It
+# runs the table loop directly on the data, so no reflection is needed.
+# Without the native emitter the viper module fails to compile, which
+# surfaces here as a SyntaxError.
+try:
+    from crc_viper import stm32_crc32_words as _stm32_crc32_words
+except (ImportError, SyntaxError):
+    _stm32_crc32_words = None
+
+def _stm32_crc32_update_native(crc, data):
+    """Viper version of _stm32_crc32_update_table for whole words"""
+    mv = memoryview(data)
+    n = len(mv)
+    end = n & ~3
+    crc = _stm32_crc32_words(crc, mv, end, CRC_TABLE) & 0xFFFFFFFF
+    if end < n:
+        crc = _stm32_crc32_update_table(crc, mv[end:])
+    return crc
+
+_native_update = _stm32_crc32_update_native if _stm32_crc32_words is not None else None
+
+# Whether the running value is kept in binascii's reflected form
+_REFLECTED = _native_update is None and _crc32 is not None
+
+# Each path only pays for its own tables; on a Pico the reflected path's
+# scratch buffer alone would be another 4 KiB of RAM. _order is the word
+# reordering the reflected path feeds to _crc32.
+_order = _stm32_order
+if _REFLECTED:
+    _BITREV = _make_bitrev_table()
+    if hasattr(bytes, 'translate'):
+        _order = _stm32_order_translate  # No scratch buffer needed
+    else:
+        _crc_scratch = bytearray(COPY_BLOCK)
+else:
+    CRC_TABLE = _make_crc_table()
+    if _native_update is None:
+        _SLICE_TABLES = _make_slice_tables(CRC_TABLE)
+
+# ================================
+# Parallel CRC for Large Images
+# ================================
+def _multmodp(a, b):
+    """Multiply a by b modulo the reflected CRC32 polynomial"""
+    m = 1 << 31
+    p = 0
+    while True:
+        if a & m:
+            p ^= b
+            if (a & (m - 1)) == 0:
+                break
+        m >>= 1
+        b = (b >> 1) ^ 0xEDB88320 if b & 1 else b >> 1
+    return p
+
+def _make_x2n_table():
+    """x^(2^n) modulo the polynomial, for n = 0..31"""
+    table = []
+    p = 1 << 30  # x^1
+    for _ in range(32):
+        table.append(p)
+        p = _multmodp(p, p)
+    return table
+
+_X2N = None  # Built on first use
+
+def crc32_combine(crc1, crc2, len2):
+    """
+    Combine the reflected CRC32 of two blocks into that of their
+    concatenation, given the second block's length (zlib's algorithm).
+    """
+    global _X2N
+    if _X2N is None:
+        _X2N = _make_x2n_table()
+    p = 1 << 31  # x^0
+    n = len2
+    k = 3  # Lengths are in bytes: x^(8 * len2)
+    while n:
+        if n & 1:
+            p = _multmodp(_X2N[k & 31], p)
+        n >>= 1
+        k += 1
+    return _multmodp(p, crc1) ^ crc2
+
+def _crc_segment(filename, offset, length):
+    """Reflected CRC of one segment, starting from 0; runs in a worker"""
+    value = 0
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        while length > 0:
+            chunk = f.read(min(COPY_BLOCK, length))
+            value = _crc32(_order(chunk), value)
+            length -= len(chunk)
+    return value
+
+def _parallel_stm32_crc32(filename, size):
+    """
+    STM32 CRC of a large file computed as word-aligned segments in parallel
+    processes, joined with crc32_combine in the reflected domain.
+    """
+    workers = os.cpu_count() or 1
+    seg = ((size + workers - 1) // workers + 3) & ~3
+    offsets = list(range(0, size, seg))
+    lengths = [min(seg, size - off) for off in offsets]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(_crc_segment, [filename] * len(offsets), offsets, lengths))
+    
+    value = parts[0]
+    for part, length in zip(parts[1:], lengths[1:]):
+        # The last segment's partial word is hashed zero padded
+        value = crc32_combine(value, part, (length + 3) & ~3)
+    return _bitrev32(value ^ 0xFFFFFFFF)
+
+def use_parallel_crc(size):
+    """True if a file of this size is worth hashing with _parallel_stm32_crc32"""
+    return (size >= PARALLEL_CRC_MIN and ProcessPoolExecutor is not None
+            and _REFLECTED and (os.cpu_count() or 1) > 1)
+
 def calculate_stm32_crc32(filename):
     """
     Compute CRC32 exactly matching STM32 hardware implementation:
@@ -19,63 +333,191 @@ def calculate_stm32_crc32(filename):
     - Processes 32-bit words in little-endian format
     - No final inversion (unlike standard CRC32)
     """
-    crc = 0xFFFFFFFF
-    chunk_size = 256  # Memory efficient for MicroPython
+    hasher = STM32CRC32()
     
+    gc.collect()  # Free garbage up front, once per file
     try:
+        size = os.stat(filename)[6]
+        if use_parallel_crc(size):
+            return '%08x' % _parallel_stm32_crc32(filename, size)
+        
         with open(filename, 'rb') as f:
             while True:
-                chunk = f.read(chunk_size)
+                chunk = f.read(COPY_BLOCK)
                 if not chunk:
                     break
-                
-                # Process chunk in 32-bit words (like STM32 HAL_CRC_Calculate)
-                i = 0
-                while i + 3 < len(chunk):
-                    # Extract 4 bytes and convert to little-endian 32-bit word
-                    word = struct.unpack('<I', chunk[i:i+4])[0]
-                    crc ^= word
-                    
-                    # Process 32 bits
-                    for _ in range(32):
-                        if crc & 0x80000000:
-                            crc = ((crc << 1) ^ 0x04C11DB7) & 0xFFFFFFFF
-                        else:
-                            crc = (crc << 1) & 0xFFFFFFFF
-                    i += 4
-                
-                # Handle remaining bytes (like STM32 HAL_CRC_Accumulate for partial words)
-                if i < len(chunk):
-                    remaining = chunk[i:]
-                    # Pad to 4 bytes with zeros (like STM32 does)
-                    padded = remaining + b'\x00' * (4 - len(remaining))
-                    word = struct.unpack('<I', padded)[0]
-                    crc ^= word
-                    
-                    # Process 32 bits
-                    for _ in range(32):
-                        if crc & 0x80000000:
-                            crc = ((crc << 1) ^ 0x04C11DB7) & 0xFFFFFFFF
-                        else:
-                            crc = (crc << 1) & 0xFFFFFFFF
-                
-                gc.collect()  # Important for MicroPython memory management
+                hasher.update(chunk)
         
-        return '%08x' % crc
+        gc.collect()
+        return '%08x' % hasher.finalize()
         
     except Exception as e:
         print(f"❌ CRC32 calculation error: {e}")
         return None
 
 # ============================
-# Semantic Version Comparison
+# Semantic Version Parsing
+# ============================
+def version_tuple(version):
+    """Parse a dotted version string into a tuple that compares numerically
+
+    Trailing zero components are dropped, so "3.1.0" equals "3.1" as it
+    did when both sides were zero-padded before comparing.
+    """
+    parts = [int(x) for x in version.split(".")]
+    while parts and parts[-1] == 0:
+        parts.pop()
+    return tuple(parts)
+
+# ============================
+# Metadata Serialization
 # ============================
-def compare_versions(version1, version2):
-    v1 = [int(x) for x in version1.split(".")]
-    v2 = [int(x) for x in version2.split(".")]
-    while len(v1) < len(v2): v1.append(0)
-    while len(v2) < len(v1): v2.append(0)
-    return (v1 > v2) - (v1 < v2)
+if orjson is not None:
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+else:
+    _json_loads = json.loads
+
+    def _json_dumps(obj):
+        """json.dumps returning bytes, like orjson.dumps"""
+        return json.dumps(obj).encode()
+
+def write_metadata(metadata):
+    """
+    Replace metadata.json atomically: the whole document is encoded once,
+    written to a temporary file and renamed over the old one, so a power
+    cut mid-write leaves the old file rather than a truncated one.
+    """
+    tmp = METADATA_FILE + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(_json_dumps(metadata))
+        if hasattr(os, 'fsync'):  # Not on MicroPython, where close() syncs
+            f.flush()
+            os.fsync(f.fileno())
+    os.rename(tmp, METADATA_FILE)
+
+# ============================
+# Append-only Metadata Log
+# ============================
+def index_entries(metadata):
+    """Map (device_type, version) to the entry's position in firmware_entries"""
+    return {(e["device_type"], e["version"]): i for i, e in enumerate(metadata["firmware_entries"])}
+
+def apply_metadata_log(metadata, index):
+    """
+    Replay entries appended to METADATA_LOG onto metadata, last write wins
+    per (device_type, version), keeping index and latest_version up to
+    date. A torn last line from an interrupted append is skipped. Returns
+    the version tuple of latest_version, as a list.
+    """
+    # Parsed once per replay; lists compare element-wise just like tuples
+    latest = list(version_tuple(metadata.get("latest_version", "0.0.0")))
+    try:
+        f = open(METADATA_LOG, 'rb')
+    except OSError:
+        return latest
+    with f:
+        for line in f:
+            try:
+                entry = _json_loads(line)
+            except ValueError:
+                continue
+            entries = metadata["firmware_entries"]
+            key = (entry["device_type"], entry["version"])
+            i = index.get(key)
+            if i is None:
+                index[key] = len(entries)
+                entries.append(entry)
+            else:
+                entries[i] = entry
+            if entry["_vtuple"] > latest:
+                metadata["latest_version"] = entry["version"]
+                latest = entry["_vtuple"]
+    return latest
+
+def append_metadata_log(entry):
+    """
+    Append entry to METADATA_LOG as one line. If an interrupted append left
+    the log without a trailing newline, the torn line is terminated first,
+    so replay drops only that line and not the new entry glued onto it.
+    """
+    try:
+        with open(METADATA_LOG, 'rb') as f:
+            f.seek(-1, 2)
+            last = f.read(1)
+    except OSError:
+        last = b"\n"  # No log yet, or an empty one
+    with open(METADATA_LOG, 'ab') as f:
+        f.write((b"" if last == b"\n" else b"\n") + _json_dumps(entry) + b"\n")
+
+# ============================
+# In-memory Metadata Cache
+# ============================
+_META_CACHE = {'key': None, 'data': None, 'index': None, 'latest': None}
+
+def _metadata_key():
+    """
+    Identify the metadata on disk by the mtime and size of metadata.json and
+    the size of the log; every upload or compaction changes at least one.
+    """
+    try:
+        st = os.stat(METADATA_FILE)
+    except OSError:
+        return None
+    try:
+        log_size = os.stat(METADATA_LOG)[6]
+    except OSError:
+        log_size = 0
+    return (st[8], st[6], log_size)
+
+def load_metadata():
+    """
+    Return metadata.json with the log applied, parsing it only when the
+    files have changed since the last call.
+    """
+    key = _metadata_key()
+    if key is not None and key == _META_CACHE['key']:
+        return _META_CACHE['data']
+
+    try:
+        with open(METADATA_FILE, 'rb') as f:
+            metadata = _json_loads(f.read())
+    except:
+        metadata = {"firmware_entries": [], "latest_version": "0.0.0"}
+    metadata.pop("_latest_vtuple", None)  # Derived from latest_version, never stored
+    index = index_entries(metadata)
+    latest = apply_metadata_log(metadata, index)
+
+    # Entries written before version tuples were stored get one now
+    for e in metadata["firmware_entries"]:
+        if "_vtuple" not in e:
+            e["_vtuple"] = list(version_tuple(e["version"]))
+
+    _META_CACHE['key'] = key
+    _META_CACHE['data'] = metadata
+    _META_CACHE['index'] = index
+    _META_CACHE['latest'] = latest
+    return metadata
+
+def _stored_copy(metadata, device_type, version, firmware_file, dest_path):
+    """
+    Return the existing entry for (device_type, version) if dest_path already
+    holds the same bytes as firmware_file: same size, and the source's CRC
+    equal to the recorded checksum. Otherwise return None.
+    """
+    i = _META_CACHE['index'].get((device_type, version))
+    if i is None:
+        return None
+    entry = metadata["firmware_entries"][i]
+    try:
+        size = os.stat(firmware_file)[6]
+        if entry.get("size") != size or os.stat(dest_path)[6] != size:
+            return None
+    except OSError:
+        return None
+    if calculate_stm32_crc32(firmware_file) != entry.get("checksum"):
+        return None
+    return entry
 
 # ============================
 # Main Upload Firmware Script
@@ -95,48 +537,60 @@ def upload_firmware(firmware_file, version, device_type, description=""):
         os.stat(METADATA_FILE)
     except OSError:
         print("📄 Metadata not found. Creating default metadata.json...")
-        with open(METADATA_FILE, 'w') as f:
-            json.dump({"firmware_entries": [], "latest_version": "0.0.0"}, f)
+        with open(METADATA_FILE, 'wb') as f:
+            f.write(_json_dumps({"firmware_entries": [], "latest_version": "0.0.0"}))
 
     # Prepare filename and paths
-    extension = firmware_file.split('.')[-1]
+    extension = firmware_file[firmware_file.rfind('.') + 1:]  # No os.path on MicroPython
     base_filename = f"{device_type}-v{version}.{extension}"
     dest_path = f"{FIRMWARE_DIR}/{base_filename}"
 
-    # Copy firmware in chunks (memory safe)
-    print("📤 Copying firmware...")
-    try:
-        total_bytes = 0
-        with open(firmware_file, 'rb') as src, open(dest_path, 'wb') as dst:
-            while True:
-                chunk = src.read(1024)
-                if not chunk:
-                    break
-                dst.write(chunk)
-                total_bytes += len(chunk)
-        print(f"✅ Copied {total_bytes} bytes")
-    except Exception as e:
-        print(f"❌ Error copying firmware: {e}")
-        return False
+    # Load metadata (cached between uploads)
+    metadata = load_metadata()
 
-    # Get file size and CRC
-    try:
-        file_size = os.stat(dest_path)[6]
-        checksum = calculate_stm32_crc32(dest_path)
-        if checksum is None:
-            print("❌ Failed to calculate CRC")
+    # A re-upload of the image already stored needs no copy
+    stored = _stored_copy(metadata, device_type, version, firmware_file, dest_path)
+    if stored is not None:
+        file_size = stored["size"]
+        checksum = stored["checksum"]
+        print(f"✅ Identical firmware already stored, skipping copy ({checksum})")
+    else:
+        # Copy firmware in chunks (memory safe), computing the CRC in the same
+        # pass. Large images are copied first and then hashed in parallel.
+        print("📤 Copying firmware...")
+        try:
+            parallel = use_parallel_crc(os.stat(firmware_file)[6])
+            hasher = None if parallel else STM32CRC32()
+            buf = bytearray(COPY_BLOCK)  # Reused for every block, no per-read allocation
+            mv = memoryview(buf)
+            # Buffers sized to the block; MicroPython accepts and ignores buffering
+            with open(firmware_file, 'rb', buffering=COPY_BLOCK) as src, open(dest_path, 'wb', buffering=COPY_BLOCK) as dst:
+                while True:
+                    n = src.readinto(buf)
+                    if not n:
+                        break
+                    chunk = mv[:n]
+                    dst.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+        except Exception as e:
+            print(f"❌ Error copying firmware: {e}")
             return False
-        print(f"🧮 STM32-Compatible CRC32: {checksum}")
-    except Exception as e:
-        print(f"❌ Error gathering info: {e}")
-        return False
 
-    # Load metadata
-    try:
-        with open(METADATA_FILE, 'r') as f:
-            metadata = json.load(f)
-    except:
-        metadata = {"firmware_entries": [], "latest_version": "0.0.0"}
+        # Get file size
+        try:
+            file_size = os.stat(dest_path)[6]
+            print(f"✅ Copied {file_size} bytes")
+            if hasher is None:
+                checksum = calculate_stm32_crc32(dest_path)
+                if checksum is None:
+                    return False
+            else:
+                checksum = '%08x' % hasher.finalize()
+            print(f"🧮 STM32-Compatible CRC32: {checksum}")
+        except Exception as e:
+            print(f"❌ Error gathering info: {e}")
+            return False
 
     # Create or update firmware entry
     entry = {
@@ -146,32 +600,44 @@ def upload_firmware(firmware_file, version, device_type, description=""):
         "size": file_size,
         "checksum": checksum,
         "description": description,
-        "upload_date": time.time()
+        "upload_date": time.time(),
+        "_vtuple": list(version_tuple(version))
     }
 
-    updated = False
-    for i, e in enumerate(metadata["firmware_entries"]):
-        if e["device_type"] == device_type and e["version"] == version:
-            metadata["firmware_entries"][i] = entry
-            updated = True
-            print("🔄 Updated existing entry")
-            break
-
-    if not updated:
+    index = _META_CACHE['index']
+    i = index.get((device_type, version))
+    if i is not None:
+        # Nothing to record if only the upload date would change; saves a
+        # flash write (latest_version already accounts for this entry)
+        old = metadata["firmware_entries"][i]
+        if len(old) == len(entry) and all(old.get(k) == v for k, v in entry.items() if k != "upload_date"):
+            print("↩️ Metadata unchanged, skipping write")
+            print("🎉 Firmware upload complete!")
+            return True
+        metadata["firmware_entries"][i] = entry
+        print("🔄 Updated existing entry")
+    else:
+        index[(device_type, version)] = len(metadata["firmware_entries"])
         metadata["firmware_entries"].append(entry)
         print("➕ Added new entry")
 
     # Update latest version if needed
-    if compare_versions(version, metadata.get("latest_version", "0.0.0")) > 0:
+    if entry["_vtuple"] > _META_CACHE['latest']:
         metadata["latest_version"] = version
+        _META_CACHE['latest'] = entry["_vtuple"]
         print(f"⬆️ Updated latest_version to {version}")
 
-    # Save metadata
+    # Append the entry to the log rather than rewriting all of metadata.json
     try:
-        with open(METADATA_FILE, 'w') as f:
-            json.dump(metadata, f)
+        append_metadata_log(entry)
+        if os.stat(METADATA_LOG)[6] > METADATA_LOG_MAX:
+            write_metadata(metadata)
+            os.remove(METADATA_LOG)
+            print("🗜️ Compacted metadata log")
+        _META_CACHE['key'] = _metadata_key()  # The cached dict is already up to date
         print("✅ Metadata updated successfully")
     except Exception as e:
+        _META_CACHE['key'] = None  # Cached dict no longer matches the disk
         print(f"❌ Failed to save metadata: {e}")
         return False
 
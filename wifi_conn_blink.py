@@ -8,11 +8,22 @@ led = machine.Pin('LED', machine.Pin.OUT) #configure LED Pin as an output pin an
 
 wlan = network.WLAN(network.STA_IF)
 wlan.active(True)
+try:
+    wlan.config(pm=0xa11140)  # Turn off Wi-Fi power saving, which slows association on the Pico W
+except (ValueError, OSError):
+    pass
 
+backoff = 1  # Seconds to wait before the next attempt, doubled up to 30
 while not wlan.isconnected():
     print("Connecting to Wi-Fi...")
     wlan.connect(secrets.SSID, secrets.PASSWORD)
-    time.sleep(10)  # Wait for 10 seconds before trying again
+    for _ in range(100):  # Poll every 100 ms for up to 10 seconds
+        if wlan.isconnected():
+            break
+        time.sleep_ms(100)
+    else:
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 30)
 
 print("Connect successful")
 blink.blinking()
\ No newline at end of file